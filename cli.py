@@ -0,0 +1,188 @@
+"""
+Headless command line entry point.
+
+    python cli.py run --input-size 20000 --compute-time 28 --time-out tasks.csv
+    python cli.py replay trace.csv --mem-out mem.csv --time-out tasks.csv
+    python cli.py evaluate
+    python cli.py serve --port 8642 --workers 4
+    python cli.py submit --input-size 20000 --compute-time 28 --real-log real_log/ex1/20gb/timestamps_pipeline.csv
+
+Modules are imported by the subcommand that needs them, matplotlib only with run --plot.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+
+
+def parse_overrides(args):
+    """
+    :return: overrides dictionary of the --set options
+    :raise ValueError: if a value is not a number or the overrides are invalid for the profile
+    """
+    from pipeline import validate_overrides
+
+    overrides = {}
+    for key, value in (args.set or []):
+        section, _, param = key.partition(".")
+        try:
+            overrides.setdefault(section, {})[param] = float(value)
+        except ValueError:
+            raise ValueError("%s must be a number, got %r" % (key, value))
+    validate_overrides(args.profile, overrides)
+    return overrides
+
+
+def workload_from_args(args):
+    workload = {
+        "profile": args.profile,
+        "overrides": parse_overrides(args),
+        "input_size": args.input_size,
+        "compute_time": args.compute_time,
+        "n_tasks": args.tasks,
+    }
+    if getattr(args, "real_log", None):
+        workload["real_log"] = args.real_log
+    return workload
+
+
+def cmd_run(args):
+    from pipeline import create_kernel
+    from pipeline import run_pipeline
+    from pipeline import export_mem
+    from pipeline import export_time
+
+    kernel = create_kernel(args.profile, **parse_overrides(args))
+    tasks = run_pipeline(kernel, args.input_size, args.compute_time, n_tasks=args.tasks, verbose=args.verbose)
+
+    if args.mem_out:
+        export_mem(kernel.memory.get_log(), args.mem_out)
+    if args.time_out:
+        export_time(tasks, args.time_out)
+    else:
+        for task in tasks:
+            print("%s,%s,%s" % task)
+
+    if args.plot:
+        import plot
+        from pipeline import get_task_time
+
+        mm = kernel.memory
+        plot.plot_mem_log(mm.get_log(), get_task_time(tasks), "input = %d MB" % args.input_size,
+                          xmin=0, xmax=tasks[-1][2], ymin=-10000, ymax=mm.size * 1.05)
+
+
+def cmd_replay(args):
+    from pipeline import create_kernel
+    from trace_replay import TraceReplayer
+    from trace_replay import read_trace
+
+    kernel = create_kernel(args.profile, **parse_overrides(args))
+    replayer = TraceReplayer(kernel, args.mem_out, args.time_out, honor_timestamps=args.honor_timestamps)
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            # the output of a long trace is not kept in memory
+            stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+        end_time = replayer.replay(read_trace(args.trace))
+    print("Trace replayed in %.2f simulated sec" % end_time)
+
+
+def cmd_evaluate(args):
+    from incremental_eval import EvaluationStore
+    from incremental_eval import ex1_experiments
+
+    store = EvaluationStore(args.cache)
+    recomputed = store.evaluate(ex1_experiments())
+    print("Recomputed %d experiment sources" % len(recomputed))
+    for source, task_type, mean, maximum, count in store.get_mean_errors():
+        print("%s,%s,mean=%.4f,max=%.4f,tasks=%d" % (source, task_type, mean, maximum, count))
+    store.close()
+
+
+def cmd_serve(args):
+    from server import serve
+
+    serve(args.host, args.port, workers=args.workers)
+
+
+def cmd_submit(args):
+    import urllib.error
+    from server import submit
+
+    try:
+        result = submit(workload_from_args(args), url=args.url)
+    except urllib.error.HTTPError as e:
+        # the server explains rejected workloads and failed simulations in a JSON body
+        print(e.read().decode("utf-8"), file=sys.stderr)
+        return 1
+    print(json.dumps(result))
+
+
+def add_host_args(parser):
+    parser.add_argument("--profile", default="ex1", help="host profile")
+    parser.add_argument("--set", nargs=2, action="append", metavar=("SECTION.PARAM", "VALUE"),
+                        help="override a profile parameter, e.g. --set memory.size 100000")
+
+
+def add_workload_args(parser):
+    add_host_args(parser)
+    parser.add_argument("--input-size", type=float, required=True, help="file size in MB")
+    parser.add_argument("--compute-time", type=float, required=True, help="CPU time of each task in sec")
+    parser.add_argument("--tasks", type=int, default=3, help="number of tasks in the pipeline")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="I/O simulator")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="simulate a pipeline")
+    add_workload_args(run_parser)
+    run_parser.add_argument("--mem-out", help="output csv for the memory log")
+    run_parser.add_argument("--time-out", help="output csv for task times")
+    run_parser.add_argument("--plot", action="store_true", help="plot the memory log")
+    run_parser.add_argument("--verbose", action="store_true", help="print the simulation steps")
+    run_parser.set_defaults(func=cmd_run)
+
+    replay_parser = subparsers.add_parser("replay", help="replay an I/O trace")
+    add_host_args(replay_parser)
+    replay_parser.add_argument("trace", help="trace file (.csv or binary)")
+    replay_parser.add_argument("--mem-out", required=True, help="output csv for the memory log")
+    replay_parser.add_argument("--time-out", required=True, help="output csv for task times")
+    replay_parser.add_argument("--honor-timestamps", action="store_true",
+                               help="do not start an operation before its recorded time")
+    replay_parser.add_argument("--verbose", action="store_true", help="print the simulation steps")
+    replay_parser.set_defaults(func=cmd_replay)
+
+    evaluate_parser = subparsers.add_parser("evaluate", help="evaluate the task error of the ex1 experiments")
+    evaluate_parser.add_argument("--cache", default="eval_cache.sqlite", help="evaluation cache")
+    evaluate_parser.set_defaults(func=cmd_evaluate)
+
+    serve_parser = subparsers.add_parser("serve", help="start a local simulation server")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8642)
+    serve_parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    serve_parser.set_defaults(func=cmd_serve)
+
+    submit_parser = subparsers.add_parser("submit", help="submit a pipeline to a running server")
+    add_workload_args(submit_parser)
+    submit_parser.add_argument("--real-log", help="real time log to compute the task error against")
+    submit_parser.add_argument("--url", default="http://127.0.0.1:8642")
+    submit_parser.set_defaults(func=cmd_submit)
+
+    args = parser.parse_args(argv)
+    if "profile" in args:
+        from pipeline import create_kernel
+
+        try:
+            # building a kernel also checks the combination of parameters, e.g. of the dirty ratios
+            create_kernel(args.profile, **parse_overrides(args))
+        except ValueError as e:
+            parser.error(str(e))
+
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,18 @@
+import math
+from collections import OrderedDict
+
+
+def count_flushed(files, filename, amount):
+    """
+    Add an amount of flushed data of a file to a dictionary of flushed data per filename
+    :param files: dictionary filename -> flushed amount, or None if not tracked
+    :param filename: filename
+    :param amount: flushed amount in MB
+    """
+    if files is not None and amount > 0:
+        files[filename] = files.get(filename, 0) + amount
+
+
 class File:
     """
     File class.
@@ -15,6 +30,10 @@ class File:
         """
         self.name = name
         self.size = size
+        # read-ahead window of the current sequential stream in MB, 0 if there is none
+        self.readahead = 0
+        # offset in MB where the previous read of the file ended
+        self.read_end = 0
         # self.disk = disk
         # self.dirty = dirty
         # self.active = active
@@ -24,15 +43,24 @@ class File:
 class Block:
     """Data block of a File"""
 
-    def __init__(self, filename, size=0, dirty=False, last_access=0.0):
+    def __init__(self, filename, size=0, dirty=False, last_access=0.0, offset=0):
         self.filename = filename
         self.size = size
         self.dirty = dirty
         self.last_access = last_access
+        # offset of the data in the file in MB
+        self.offset = offset
+
+    def overlap(self, offset, end):
+        """
+        :return: amount of data of the block between offset and end of the file
+        """
+        return max(0, min(self.offset + self.size, end) - max(self.offset, offset))
 
 
 class MemoryManager:
-    def __init__(self, size=0, free=0, cache=0, dirty=0, read_bw=0, write_bw=0, dirty_expire=30):
+    def __init__(self, size=0, free=0, cache=0, dirty=0, read_bw=0, write_bw=0, dirty_expire=30,
+                 merge_interval=1):
         """
         LRU list: list of tuples, the first value is filename, the 2nd value is timestamp, the 3rd value amount of data
 
@@ -42,6 +70,7 @@ class MemoryManager:
         :param dirty: dirty data in MB
         :param read_bw: read bandwidth in MBps
         :param write_bw: write bandwidth in MBps
+        :param merge_interval: adjacent blocks of a file accessed within this time in sec are merged
         """
         self.size = size
         self.free = free
@@ -52,6 +81,7 @@ class MemoryManager:
         self.inactive = []
         self.write_bw = write_bw
         self.dirty_expire = dirty_expire
+        self.merge_interval = merge_interval
         # self.active_list = []
         # self.inactive_list = []
         self.log = {
@@ -63,22 +93,46 @@ class MemoryManager:
             "time": [0]
         }
 
-    def get_data_in_cache(self, filename):
+    def get_data_in_cache(self, filename, offset=0, amount=math.inf):
         """
         Return the amount of data cached
         :param filename:
+        :param offset: start of the data in the file in MB
+        :param amount: amount of data from offset, the rest of the file by default
         :return:
         """
-        amount = 0
+        cached = 0
         for block in self.inactive:
             if block.filename == filename:
-                amount += block.size
+                cached += block.overlap(offset, offset + amount)
 
         for block in self.active:
             if block.filename == filename:
-                amount += block.size
+                cached += block.overlap(offset, offset + amount)
 
-        return amount
+        return cached
+
+    def get_uncached_ranges(self, filename, offset, amount):
+        """
+        :param filename:
+        :param offset: start of the data in the file in MB
+        :param amount: amount of data not in cache to find
+        :return: list of (offset, size) of the first amount MB of data of the file from offset not in cache
+        """
+        cached = sorted([(block.offset, block.offset + block.size) for block in self.inactive + self.active
+                         if block.filename == filename and block.size > 0])
+        ranges = []
+        pos = offset
+        for start, end in cached + [(math.inf, math.inf)]:
+            if amount <= 0:
+                break
+            if start > pos:
+                size = min(start - pos, amount)
+                ranges.append((pos, size))
+                amount -= size
+            pos = max(pos, end)
+
+        return ranges
 
     def get_available_memory(self):
         return self.free + self.cache - self.dirty
@@ -86,83 +140,95 @@ class MemoryManager:
     def get_evictable_memory(self):
         return sum([block.size for block in self.inactive if not block.dirty])
 
-    def read_from_cache(self, filename, time):
+    def read_from_cache(self, filename, time, offset=0, amount=math.inf):
         """
         Read data from cache. All data in cache is active
         :param filename:
         :param time:
+        :param offset: start of the data read in the file in MB
+        :param amount: amount of data read from offset, the rest of the file by default
         :return:
         """
-
-        dirty = 0
-        not_dirty = 0
-        for block in self.inactive[:]:
-            if block.filename == filename:
-                if block.dirty:
-                    dirty += block.size
-                else:
-                    not_dirty += block.size
-                self.inactive.remove(block)
-
-        for block in self.active[:]:
-            if block.filename == filename:
-                if block.dirty:
-                    dirty += block.size
-                else:
-                    not_dirty += block.size
-                self.active.remove(block)
-
-        # Update all accessed data as active
-        dirty_block = Block(filename, dirty, dirty=True, last_access=time)
-        not_dirty_block = Block(filename, not_dirty, dirty=False, last_access=time)
-        self.active.append(dirty_block)
-        self.active.append(not_dirty_block)
+        end = offset + amount
+        dirty = []
+        not_dirty = []
+        for lru in (self.inactive, self.active):
+            for block in lru[:]:
+                if block.filename != filename or block.overlap(offset, end) <= 0:
+                    continue
+                lru.remove(block)
+
+                # data of the block outside of the read stays where it is
+                start = max(block.offset, offset)
+                stop = min(block.offset + block.size, end)
+                if block.offset < start:
+                    lru.append(Block(filename, start - block.offset, block.dirty, block.last_access, block.offset))
+                if stop < block.offset + block.size:
+                    lru.append(Block(filename, block.offset + block.size - stop, block.dirty, block.last_access, stop))
+
+                (dirty if block.dirty else not_dirty).append(Block(filename, stop - start, block.dirty, time, start))
+
+        # Update all accessed data as active, dirty data first
+        for blocks in (dirty, not_dirty):
+            self.active.extend(sorted(blocks, key=lambda block: block.offset))
 
         self.update_lru_lists()
 
-    def read_from_disk(self, amount, filename, time):
+    def read_from_disk(self, amount, filename, time, offset=0):
         """
         Read data not cached from disk. Add new read block to inactive list.
-        :param amount:
+        :param amount: amount of data not cached to read
         :param filename:
         :param time:
+        :param offset: the first amount MB of data of the file not cached from offset are read
         :return:
         """
 
         self.cache += amount
         self.free -= amount
 
-        block = Block(filename=filename, size=amount, dirty=False, last_access=time)
-        self.inactive.append(block)
+        for start, size in self.get_uncached_ranges(filename, offset, amount):
+            self.inactive.append(Block(filename=filename, size=size, dirty=False, last_access=time, offset=start))
         self.update_lru_lists()
 
-    def pdflush(self, current_time, max_flushed=0):
+    def pdflush(self, current_time, max_flushed=0, files=None):
+        """
+        Flush dirty data older than dirty_expire
+        :param current_time: time of the periodical flushing
+        :param max_flushed: maximum amount of data to flush, 0 means no limit
+        :param files: optional dictionary accumulating the amount flushed per filename
+        :return: amount of data flushed
+        """
 
         flushed = 0
         for block in self.inactive:
             if block.dirty and current_time - block.last_access > self.dirty_expire:
                 if 0 < max_flushed < flushed + block.size:
+                    count_flushed(files, block.filename, max_flushed - flushed)
                     flushed += max_flushed - flushed
                     # split the block, new clean block is created
                     new_blk = Block(block.filename, max_flushed - flushed, dirty=False,
-                                    last_access=block.last_access)
+                                    last_access=block.last_access, offset=block.offset + block.size)
                     self.inactive.append(new_blk)
                     block.size = block.size + flushed - max_flushed
                 else:
                     block.dirty = False
+                    count_flushed(files, block.filename, block.size)
                     flushed += block.size
 
         for block in self.active:
             if block.dirty and current_time - block.last_access > self.dirty_expire:
                 if 0 < max_flushed < flushed + block.size:
+                    count_flushed(files, block.filename, max_flushed - flushed)
                     flushed += max_flushed - flushed
                     # split the block, new clean block is created
                     new_blk = Block(block.filename, max_flushed - flushed, dirty=False,
-                                    last_access=block.last_access)
+                                    last_access=block.last_access, offset=block.offset + block.size)
                     self.inactive.append(new_blk)
                     block.size = block.size + flushed - max_flushed
                 else:
                     block.dirty = False
+                    count_flushed(files, block.filename, block.size)
                     flushed += block.size
 
         self.dirty -= flushed
@@ -185,6 +251,7 @@ class MemoryManager:
             elif evicted < amount < evicted + block.size:
                 block_evicted = amount - evicted
                 block.size -= block_evicted
+                block.offset += block_evicted
                 evicted += block_evicted
                 break
             else:
@@ -196,7 +263,7 @@ class MemoryManager:
 
         return evicted
 
-    def write(self, filename, amount, time):
+    def write(self, filename, amount, time, offset=0):
         """
         Write a file to disk through cache. The written file is not in cache. Thus, all data is in inactive list
         :param filename: filename
@@ -204,8 +271,10 @@ class MemoryManager:
         :param max_cache: maximum cache
         :param new_dirty: amount of dirty data
         :param time:
+        :param offset: offset of the data in the file in MB, cached data it overwrites is replaced
         :return:
         """
+        self.discard(filename, offset, amount)
 
         # self.inactive.append(Block(filename, amount, dirty=True, last_access=time))
 
@@ -219,11 +288,43 @@ class MemoryManager:
         self.cache += amount
         self.free -= amount
         self.dirty += amount
-        self.inactive.append(Block(filename, amount, dirty=True, last_access=time))
+        self.inactive.append(Block(filename, amount, dirty=True, last_access=time, offset=offset))
 
         self.update_lru_lists()
 
-    def flush(self, amount):
+    def discard(self, filename, offset, amount):
+        """
+        Drop cached data of a file between offset and offset + amount
+        :return: amount of data dropped
+        """
+        end = offset + amount
+        discarded = 0
+        for lru in (self.inactive, self.active):
+            for block in lru[:]:
+                if block.filename != filename or block.overlap(offset, end) <= 0:
+                    continue
+                dropped = block.overlap(offset, end)
+                lru.remove(block)
+                if block.offset < offset:
+                    lru.append(Block(filename, offset - block.offset, block.dirty, block.last_access, block.offset))
+                if end < block.offset + block.size:
+                    lru.append(Block(filename, block.offset + block.size - end, block.dirty, block.last_access, end))
+                if block.dirty:
+                    self.dirty -= dropped
+                discarded += dropped
+
+        self.cache -= discarded
+        self.free += discarded
+
+        return discarded
+
+    def flush(self, amount, files=None):
+        """
+        Flush dirty data, starting from the most recently accessed data of the inactive list
+        :param amount: amount of data to flush
+        :param files: optional dictionary accumulating the amount flushed per filename
+        :return: amount of data flushed
+        """
         if amount <= 0:
             return 0
 
@@ -235,13 +336,17 @@ class MemoryManager:
                 if flushed + block.size <= amount:
                     block.dirty = False
                     self.dirty -= block.size
+                    count_flushed(files, block.filename, block.size)
                     flushed += block.size
                 elif flushed < amount < flushed + block.size:
                     blk_flushed = amount - flushed
+                    count_flushed(files, block.filename, blk_flushed)
                     flushed += blk_flushed
                     block.size -= blk_flushed
                     self.dirty -= blk_flushed
-                    new_block = Block(block.filename, blk_flushed, dirty=False, last_access=block.last_access)
+                    new_block = Block(block.filename, blk_flushed, dirty=False, last_access=block.last_access,
+                                      offset=block.offset)
+                    block.offset += blk_flushed
                     self.inactive.append(new_block)
                 else:
                     break
@@ -253,13 +358,17 @@ class MemoryManager:
                     if flushed + block.size <= amount:
                         block.dirty = False
                         self.dirty -= block.size
+                        count_flushed(files, block.filename, block.size)
                         flushed += block.size
                     elif flushed < amount < flushed + block.size:
                         blk_flushed = amount - flushed
+                        count_flushed(files, block.filename, blk_flushed)
                         flushed += blk_flushed
                         block.size -= blk_flushed
                         self.dirty -= blk_flushed
-                        new_block = Block(block.filename, blk_flushed, dirty=False, last_access=block.last_access)
+                        new_block = Block(block.filename, blk_flushed, dirty=False, last_access=block.last_access,
+                                          offset=block.offset)
+                        block.offset += blk_flushed
                         self.active.append(new_block)
                     else:
                         break
@@ -268,6 +377,41 @@ class MemoryManager:
 
         return flushed
 
+    def flush_expired(self, amount, expired_before, files=None):
+        """
+        Flush dirty data last accessed before a given time, oldest data first
+        :param amount: maximum amount of data to flush
+        :param expired_before: only data last accessed before this time is flushed
+        :param files: optional dictionary accumulating the amount flushed per filename
+        :return: amount of data flushed
+        """
+        if amount <= 0:
+            return 0
+
+        flushed = 0
+        candidates = [(block, lru) for lru in (self.inactive, self.active) for block in lru
+                      if block.dirty and block.last_access < expired_before]
+        for block, lru in sorted(candidates, key=lambda item: item[0].last_access):
+            if flushed >= amount:
+                break
+            if flushed + block.size <= amount:
+                block.dirty = False
+                count_flushed(files, block.filename, block.size)
+                flushed += block.size
+            else:
+                blk_flushed = amount - flushed
+                block.size -= blk_flushed
+                count_flushed(files, block.filename, blk_flushed)
+                flushed += blk_flushed
+                lru.append(Block(block.filename, blk_flushed, dirty=False, last_access=block.last_access,
+                                 offset=block.offset))
+                block.offset += blk_flushed
+
+        self.dirty -= flushed
+        self.update_lru_lists()
+
+        return flushed
+
     def update_lru_lists(self):
         self.inactive = sorted(self.inactive, key=lambda block: block.last_access)
         self.active = sorted(self.active, key=lambda block: block.last_access)
@@ -282,14 +426,40 @@ class MemoryManager:
                 if active_size - block.size < avg:
                     block.size -= active_size - avg
                     new_block = Block(block.filename, active_size - avg, dirty=block.dirty,
-                                      last_access=block.last_access)
+                                      last_access=block.last_access, offset=block.offset)
+                    block.offset += active_size - avg
                     self.inactive.append(new_block)
                     break
                 else:
                     self.inactive.append(block)
                     self.active.remove(block)
 
-        self.inactive = sorted(self.inactive, key=lambda block: block.last_access)
+        self.inactive = self.merge_blocks(sorted(self.inactive, key=lambda block: block.last_access))
+        self.active = self.merge_blocks(self.active)
+
+    def merge_blocks(self, blocks):
+        """
+        Merge consecutive blocks of an LRU list holding adjacent data of a file in the same state and
+        accessed within merge_interval, so that the number of blocks does not grow with the number of
+        I/O operations. Merged dirty data keeps the older access time, merged clean data the newer one.
+        :param blocks: LRU list sorted by last access
+        :return: merged LRU list, without empty blocks
+        """
+        merged = []
+        for block in blocks:
+            if block.size <= 0:
+                continue
+            last = merged[-1] if merged else None
+            if last is not None and last.filename == block.filename and last.dirty == block.dirty \
+                    and abs(last.offset + last.size - block.offset) <= 1e-9 \
+                    and block.last_access - last.last_access <= self.merge_interval:
+                last.size += block.size
+                if not block.dirty:
+                    last.last_access = block.last_access
+            else:
+                merged.append(block)
+
+        return merged
 
     def add_log(self, time):
         self.log["time"].append(time)
@@ -348,67 +518,302 @@ class MemoryManager:
 
 
 class Storage:
-    def __init__(self, size=0, read_bw=0, write_bw=0):
+    def __init__(self, size=0, read_bw=0, write_bw=0, latency=0):
         """
 
         :param size: total capacity in MB
         :param read_bw: read bandwidth in MBps
         :param write_bw: write bandwidth in MBps
+        :param latency: fixed cost of a read request in sec
         """
         self.size = size
         self.read_bw = read_bw
         self.write_bw = write_bw
+        self.latency = latency
 
-    def read(self, amount):
+    def read(self, amount, filename=None):
         return amount / self.read_bw
 
-    def write(self, amount):
+    def write(self, amount, filename=None):
         return amount / self.write_bw
 
+    def write_files(self, files):
+        """
+        Write flushed data of several files
+        :param files: dictionary filename -> amount in MB
+        :return: write time
+        """
+        return self.write(sum(files.values()))
+
+    def get_write_bw(self, amount):
+        """
+        :param amount: amount of data about to be written in MB
+        :return: average bandwidth of the write in MBps
+        """
+        return self.write_bw
+
+    def set_size(self, filename, size):
+        pass
+
+
+class TieredStorage:
+    def __init__(self, tiers):
+        """
+        Ordered storage tiers, e.g. a burst buffer or local SSD in front of a HDD or a parallel
+        file system. Upper tiers are write-back caches of the last tier, which holds all data.
+        Written data lands in the first tier and is written back to the next tier when it is
+        demoted to make room. Data read from lower tiers is promoted to the first tier.
+
+        Each cache tier keeps an LRU dictionary filename -> [cached MB, dirty MB]. read_bw, write_bw
+        and latency are the ones of the first tier, the bandwidth of a write depending on the
+        occupancy of the tiers is given by get_write_bw.
+
+        :param tiers: list of Storage, fastest first
+        """
+        self.tiers = tiers
+        self.size = tiers[-1].size
+        self.read_bw = tiers[0].read_bw
+        self.write_bw = tiers[0].write_bw
+        self.latency = tiers[0].latency
+        self.cached = [OrderedDict() for _ in tiers[:-1]]
+        self.used = [0] * (len(tiers) - 1)
+        # filename -> file size in MB
+        self.sizes = {}
+
+    def set_size(self, filename, size):
+        """
+        Record the size of a file, the data of a file kept in a tier is limited to it
+        :param filename: filename
+        :param size: file size in MB
+        """
+        self.sizes[filename] = size
+
+    def read(self, amount, filename=None):
+        """
+        Read data of a file from the tiers holding it, then promote it to the first tier
+        :param amount: amount of data in MB
+        :param filename: filename
+        :return: read time
+        """
+        read_time = 0
+        remaining = amount
+        from_lower = 0
+        for level in range(len(self.cached)):
+            if remaining <= 0:
+                break
+            entry = self.cached[level].get(filename)
+            if entry is None:
+                continue
+            tier_amt = min(remaining, entry[0])
+            read_time += self.tiers[level].read(tier_amt)
+            remaining -= tier_amt
+            if level > 0:
+                from_lower += tier_amt
+            self.cached[level].move_to_end(filename)
+
+        if remaining > 0:
+            read_time += self.tiers[-1].read(remaining)
+            from_lower += remaining
+
+        # promotion overlaps with the read, only demotions needed to make room are charged
+        if from_lower > 0 and len(self.cached) > 0:
+            read_time += self.store(0, filename, min(from_lower, self.tiers[0].size), dirty=False)
+
+        return read_time
+
+    def write(self, amount, filename=None):
+        """
+        Write data of a file to the first tier, data not fitting in a tier goes to the next one
+        :param amount: amount of data in MB
+        :param filename: filename
+        :return: write time
+        """
+        return self.store(0, filename, amount, dirty=True, charge=True)
+
+    def write_files(self, files):
+        """
+        Write flushed data of several files
+        :param files: dictionary filename -> amount in MB
+        :return: write time
+        """
+        return sum([self.write(amount, filename) for filename, amount in files.items()])
+
+    def get_write_bw(self, amount):
+        """
+        Average bandwidth of writing an amount of data with the current occupancy of the tiers.
+        Data lands in the first tier and what does not fit goes to the next one. Making room in a full
+        tier evicts its data, of which the dirty share is written back to the next tier.
+        :param amount: amount of data about to be written in MB, at least 1 MB is assumed
+        :return: bandwidth in MBps
+        """
+        amount = max(amount, 1)
+        return amount / self.write_time(0, amount)
+
+    def write_time(self, level, amount):
+        """
+        Estimated time to store an amount of data in a tier and the tiers below, see get_write_bw
+        """
+        tier = self.tiers[level]
+        if level == len(self.cached) or amount <= 0:
+            return amount / tier.write_bw
+
+        new_amt = min(amount, tier.size)
+        used = self.used[level]
+        dirty = sum([entry[1] for entry in self.cached[level].values()])
+        written_back = max(0, new_amt - (tier.size - used)) * dirty / used if used > 0 else 0
+
+        return new_amt / tier.write_bw + self.write_time(level + 1, amount - new_amt + written_back)
+
+    def store(self, level, filename, amount, dirty=True, charge=False):
+        """
+        Store data of a file in a tier. A tier never holds more of a file than its size: data
+        beyond it is a rewrite of data already in the tier, which is updated in place.
+        :param level: index of the tier
+        :param filename: filename
+        :param amount: amount of data in MB
+        :param dirty: data is not written back to the next tier yet
+        :param charge: charge the write time of the tier
+        :return: time spent
+        """
+        if amount <= 0:
+            return 0
+
+        tier = self.tiers[level]
+        if level == len(self.cached):
+            return tier.write(amount) if charge else 0
+
+        lru = self.cached[level]
+        entry = lru.setdefault(filename, [0, 0])
+        lru.move_to_end(filename)
+        extent = self.sizes.get(filename, math.inf)
+
+        # data of the file not in the tier yet, and data rewritten in place
+        new_amt = min(amount, max(0, extent - entry[0]), tier.size)
+        in_place = min(amount - new_amt, entry[0])
+
+        spent = self.demote(level, new_amt - (tier.size - self.used[level]), keep=filename)
+        new_amt = min(new_amt, tier.size - self.used[level])
+        if charge:
+            spent += tier.write(new_amt + in_place)
+
+        entry[0] += new_amt
+        if dirty:
+            entry[1] = min(entry[0], entry[1] + new_amt + in_place)
+        self.used[level] += new_amt
+        if entry[0] <= 0:
+            del lru[filename]
+        elif entry[0] > extent:
+            raise ValueError("%s: %.2f MB in tier %d, larger than the file (%.2f MB)"
+                             % (filename, entry[0], level, extent))
+
+        # data not fitting in the tier goes to the next one
+        spent += self.store(level + 1, filename, amount - new_amt - in_place, dirty=dirty, charge=charge)
+
+        return spent
+
+    def demote(self, level, amount, keep=None):
+        """
+        Evict least recently used data from a tier. Clean data is dropped, dirty data is written
+        back to the next tier.
+        :param level: index of the tier
+        :param amount: amount of data to evict
+        :param keep: filename not to evict
+        :return: write-back time
+        """
+        spent = 0
+        for filename in list(self.cached[level]):
+            if amount <= 0:
+                break
+            if filename == keep:
+                continue
+            entry = self.cached[level][filename]
+            evicted = min(amount, entry[0])
+            dirty = min(evicted, entry[1])
+            entry[0] -= evicted
+            entry[1] -= dirty
+            self.used[level] -= evicted
+            amount -= evicted
+            if entry[0] <= 0:
+                del self.cached[level][filename]
+            spent += self.store(level + 1, filename, dirty, dirty=True, charge=True)
+
+        return spent
+
+    def get_tier_usage(self):
+        """
+        :return: list of (used MB, dirty MB) of each cache tier
+        """
+        return [(self.used[level], sum([entry[1] for entry in self.cached[level].values()]))
+                for level in range(len(self.cached))]
+
 
 class IOManager:
     def __init__(self, memory_, storage_, dirty_ratio=0.2, dirty_bg_ratio=0.1,
-                 pdflush_interval=5, start_time=0):
+                 pdflush_interval=5, start_time=0, readahead_init=0.128, readahead_max=2):
+        """
+        :param readahead_init: initial read-ahead window in MB
+        :param readahead_max: maximum read-ahead window in MB
+        """
+        if not 0 <= dirty_bg_ratio <= dirty_ratio <= 1:
+            raise ValueError("dirty ratios must satisfy 0 <= dirty_bg_ratio <= dirty_ratio <= 1, got %r and %r"
+                             % (dirty_bg_ratio, dirty_ratio))
         self.memory = memory_
         self.storage = storage_
         self.dirty_ratio = dirty_ratio
         self.dirty_bg_ratio = dirty_bg_ratio
         self.last_pdflush = start_time
         self.pdflush_interval = pdflush_interval
+        self.readahead_init = readahead_init
+        self.readahead_max = readahead_max
 
-    def read(self, file, run_time=0):
+    def read(self, file, run_time=0, offset=0, amount=None):
+        """
+        :param file: File being read
+        :param run_time: start time
+        :param offset: offset of the read in the file in MB
+        :param amount: amount of data read in MB, the rest of the file by default
+        :return: end time
+        """
+        if amount is None:
+            amount = file.size - offset
         self.memory.add_log(run_time)
         print("%.2f Start reading %s" % (run_time, file.name))
+        self.storage.set_size(file.name, file.size)
 
-        cached_amt = self.memory.get_data_in_cache(file.name)
-        from_disk = file.size - cached_amt
+        # a read that does not continue the previous one ends the sequential stream
+        if offset != file.read_end:
+            file.readahead = 0
+        file.read_end = offset + amount
+
+        cached_amt = self.memory.get_data_in_cache(file.name, offset, amount)
+        from_disk = amount - cached_amt
 
         # ============= FORCED FLUSHING - EVICTION ==========
-        # Memory required to accommodate file on top of available memory
-        # memory required for the file: 2 * file.size - cached_amt
+        # Memory required to accommodate the data read on top of available memory
+        # memory required for the data read: 2 * amount - cached_amt
         # memory immediately available:  free + evictable
         # calculate the amount to flush if needed
-        flush_time = self.flush(2 * file.size - cached_amt - self.memory.free - self.memory.get_evictable_memory())
+        flush_time = self.flush(2 * amount - cached_amt - self.memory.free - self.memory.get_evictable_memory())
         run_time += flush_time
         print("\tPre-flush in %.2f sec" % flush_time)
         # then evict old pages if needed
-        self.evict(2 * file.size - cached_amt - self.memory.free)
+        self.evict(2 * amount - cached_amt - self.memory.free)
 
         self.memory.add_log(run_time)
 
         # ===================== START READING =====================
         # if part of file is cached, access pages in cache again to update LRU lists
+        mem_read_time = 0
         if cached_amt > 0:
             # Re-access cache data
-            self.memory.read_from_cache(file.name, run_time)
+            self.memory.read_from_cache(file.name, run_time, offset, amount)
 
             # bcz cache read and periodical flushing are concurrent, take the longer
             mem_read_time = cached_amt / self.memory.read_bw
 
             # concurrent periodical flushing if there is still dirty old data after forced flushing
             # periodical flushing duration is limited to cache read time
-            self.period_flush(run_time, mem_read_time)
-            run_time += mem_read_time
+            run_time += max(mem_read_time, self.period_flush(run_time, mem_read_time))
 
             # application occupies memory to store read data
             self.memory.free -= cached_amt
@@ -425,13 +830,13 @@ class IOManager:
             self.memory.add_log(run_time)
             print("\tpdflush in %.2f sec" % pdflush_time)
 
-            # add to inactive list
-            self.memory.read_from_disk(from_disk, file.name, run_time)
+            # add prefetched pages to inactive list
+            self.memory.read_from_disk(from_disk, file.name, run_time, offset)
             # mem used by application
             self.memory.free -= from_disk
 
-            # time to read from disk
-            disk_read_time = self.storage.read(from_disk)
+            # time to read from disk, pipelined with the cache read by read-ahead
+            disk_read_time = self.readahead_read_time(file, from_disk, overlap=mem_read_time)
             run_time += disk_read_time
             self.memory.add_log(run_time)
 
@@ -439,72 +844,161 @@ class IOManager:
 
         return run_time
 
-    def write(self, file, run_time=0):
+    def write(self, file, run_time=0, offset=0, amount=None):
+        """
+        :param file: File being written
+        :param run_time: start time
+        :param offset: offset of the write in the file in MB
+        :param amount: amount of data written in MB, the rest of the file by default
+        :return: end time
+        """
+        if amount is None:
+            amount = file.size - offset
         print("%.2f Start writing %s " % (run_time, file.name))
         self.memory.add_log(run_time)
+        self.storage.set_size(file.name, file.size)
 
-        # ============= WRITE WITH MEMORY BW ===============
-        # Write data before dirty_data is reached
-        remaining_dirty = self.dirty_ratio * self.memory.get_available_memory() - self.memory.dirty
-
-        mem_bw_amt = 0
-        if remaining_dirty > 0:
-            # Amount of data that makes dirty data reach dirty_ratio
-            # Before this point, data is written to cache with memory bw
-            # and dirty data is flushed to disk concurrently
-            # max_free_amt = remaining_dirty * self.memory.write_bw / (self.memory.write_bw - self.storage.write_bw)
-            max_free_amt = remaining_dirty
+        # Thresholds are computed once for the whole file
+        available = self.memory.get_available_memory()
+        bg_threshold = self.dirty_bg_ratio * available
+        threshold = self.dirty_ratio * available
 
+        # ============= WRITE WITH MEMORY BW ===============
+        # Write data before dirty_bg_ratio is reached, only periodical flushing happens meanwhile
+        mem_bw_amt = max(0, min(amount, bg_threshold - self.memory.dirty))
+        if mem_bw_amt > 0:
             # data written to cache with memory bandwidth
-            mem_bw_amt = min(file.size, max_free_amt)
             self.evict(mem_bw_amt - self.memory.free)
             mem_bw_write_time = mem_bw_amt / self.memory.write_bw
 
-            # periodically flush during cache write with memory bandwidth
-            self.period_flush(run_time, mem_bw_write_time)
+            # periodically flush during cache write with memory bandwidth, take the longer
+            mem_bw_write_time = max(mem_bw_write_time, self.period_flush(run_time, mem_bw_write_time))
 
-            self.memory.write(file.name, amount=mem_bw_amt, time=run_time)
+            self.memory.write(file.name, amount=mem_bw_amt, time=run_time, offset=offset)
             run_time += mem_bw_write_time
 
             self.memory.add_log(run_time)
             print("\tWrite to cache %d MB in %.2f sec" % (mem_bw_amt, mem_bw_write_time))
 
-        disk_bw_amt = file.size - mem_bw_amt
+        throttled_amt = amount - mem_bw_amt
 
-        # ============= WRITE WITH DISK BW =============
-        # Write dirty data after dirty_ratio is reached
-        if disk_bw_amt > 0:
-            # flush as much as we can because dirty data is full now
-            # because now flushing and cache write can be concurrent,
-            # it does not take time
-            self.flush(disk_bw_amt)
+        # ============= THROTTLED WRITE =============
+        # Above dirty_bg_ratio, background flushing runs at disk bw and the writer is throttled
+        # proportionally to the dirty data between dirty_bg_ratio and dirty_ratio
+        if throttled_amt > 0:
+            disk_bw = self.storage.get_write_bw(throttled_amt)
+            throttled_time = self.throttled_write_time(throttled_amt, self.memory.dirty, bg_threshold, threshold,
+                                                       disk_bw)
 
             # evict as much as we can to get more free memory for written file
-            self.memory.evict(disk_bw_amt - self.memory.free)
-
-            # amount of data written and remained in cache after all remaining data is written
-            # In case free memory is less than remaining amount, data is written, flushed and evicted right away
-            # to accommodate unwritten data
-            to_cache_amt = min(self.memory.free, disk_bw_amt)
-            # to_disk_amt = throttled_amt - to_cache_amt
-
-            disk_bw_write_time = self.storage.write(disk_bw_amt)
-            # disk_write_time = to_disk_amt / self.storage.write_bw
-
-            run_time += disk_bw_write_time
-            self.memory.write(file.name, amount=to_cache_amt, time=run_time)
-
+            self.memory.evict(throttled_amt - self.memory.free)
+
+            # In case free memory is less than the written amount, data is written, flushed and evicted
+            # right away to accommodate unwritten data
+            to_cache_amt = min(self.memory.free, throttled_amt)
+            self.memory.write(file.name, amount=to_cache_amt, time=run_time, offset=offset + mem_bw_amt)
+            storage_time = self.storage.write(throttled_amt - to_cache_amt, file.name)
+
+            # concurrent background flushing of the oldest dirty data, with the disk bandwidth not used
+            # by the data written directly
+            flushed = {}
+            self.memory.flush_expired(throttled_time * disk_bw - (throttled_amt - to_cache_amt),
+                                      math.inf, files=flushed)
+            storage_time += self.storage.write_files(flushed)
+
+            # the writer is throttled to the storage, which can be slower than estimated
+            throttled_time = max(throttled_time, storage_time)
+            run_time += throttled_time
             self.memory.add_log(run_time)
 
-            print("\tWrote with disk bw %d MB in %.2f sec" % (disk_bw_amt, disk_bw_write_time))
+            print("\tThrottled write %d MB in %.2f sec" % (throttled_amt, throttled_time))
 
         print("%.2f File %s is written " % (run_time, file.name))
 
         return run_time
 
+    def readahead_read_time(self, file, amount, overlap=0):
+        """
+        Time to read data of a sequentially accessed file from disk with read-ahead.
+        Data is read in requests of the read-ahead window, each one costing the storage latency on top
+        of its transfer time, so small windows lower the throughput. A new sequential stream reads its
+        first window of readahead_init synchronously. When the read continues the stream of the previous
+        read of the file, the window kept in file.readahead was already requested asynchronously and
+        nothing is read synchronously. The window doubles for every request up to readahead_max and the
+        next window is read while the application consumes the current one. Uncached pages are assumed
+        to be spread over the file, so the disk read also overlaps with the consumption of the cached
+        part of the file.
+        :param file: File being read, its read-ahead window is updated
+        :param amount: amount of data read from disk
+        :param overlap: time spent consuming cached data of the file
+        :return: read time on top of overlap
+        """
+        transfer_time = self.storage.read(amount, file.name)
+
+        if file.readahead > 0:
+            window = file.readahead
+            first = 0
+        else:
+            window = self.readahead_init
+            first = min(window, amount)
+        requests = 1 if first > 0 else 0
+        remaining = amount - first
+        while remaining > 0 and window < self.readahead_max:
+            window = min(2 * window, self.readahead_max)
+            remaining -= window
+            requests += 1
+        if remaining > 0:
+            requests += math.ceil(remaining / window)
+        file.readahead = window
+
+        # synchronous first window, pipelined windows, consumption of the last window
+        disk_time = transfer_time + requests * self.storage.latency
+        stall = transfer_time * first / amount + self.storage.latency if first > 0 else 0
+        tail = min(window, amount) / self.memory.read_bw
+
+        return stall + max(disk_time - stall, overlap) + tail - overlap
+
+    def throttled_write_time(self, amount, dirty, bg_threshold, threshold, disk_bw):
+        """
+        Time to write data while background flushing runs, balance_dirty_pages style.
+        The writer rate decreases linearly from memory bw at bg_threshold to disk bw at threshold:
+            rate(d) = mem_bw - (mem_bw - disk_bw) * (d - bg_threshold) / (threshold - bg_threshold)
+        and dirty data grows at rate(d) - disk_bw, so it approaches threshold exponentially:
+            d(t) = threshold - (threshold - d0) * exp(-k * t),  k = (mem_bw - disk_bw) / (threshold - bg_threshold)
+        The data written by time t is disk_bw * t + d(t) - d0, which is solved for the amount with Newton's
+        method (the function is concave, so the iterations increase monotonically to the root).
+        :param amount: amount of data to write
+        :param dirty: dirty data when the write starts
+        :param bg_threshold: dirty data where background flushing and throttling start
+        :param threshold: dirty data where the writer is limited to disk bw
+        :param disk_bw: write bandwidth of the storage
+        :return: write time
+        """
+        mem_bw = self.memory.write_bw
+        if mem_bw <= disk_bw:
+            return amount / mem_bw
+
+        dirty = max(dirty, bg_threshold)
+        headroom = threshold - dirty
+        if headroom <= 0 or threshold <= bg_threshold:
+            return amount / disk_bw
+
+        k = (mem_bw - disk_bw) / (threshold - bg_threshold)
+        t = amount / mem_bw
+        for _ in range(50):
+            written = disk_bw * t + headroom * (1 - math.exp(-k * t))
+            rate = disk_bw + headroom * k * math.exp(-k * t)
+            step = (amount - written) / rate
+            t += step
+            if step <= 1e-9 * t:
+                break
+
+        return t
+
     def flush(self, amount):
-        flushed_amt = self.memory.flush(amount=amount)
-        return self.storage.write(flushed_amt)
+        flushed = {}
+        self.memory.flush(amount=amount, files=flushed)
+        return self.storage.write_files(flushed)
 
     def period_flush(self, current_time, duration=0):
         """
@@ -513,13 +1007,19 @@ class IOManager:
         :param current_time: current simulated time
         :return: flushing time
         """
+        flushed = {}
         flushed_amt = 0
+        write_bw = self.storage.get_write_bw(self.memory.dirty)
         if current_time - self.last_pdflush > self.pdflush_interval:
             # update last flushing time
             self.last_pdflush += int((current_time - self.last_pdflush) / self.pdflush_interval) * self.pdflush_interval
-            flushed_amt = self.memory.pdflush(self.last_pdflush, duration * self.storage.write_bw)
+            flushed_amt = self.memory.pdflush(self.last_pdflush, duration * write_bw, files=flushed)
+
+        # background flushing above dirty_bg_ratio during the rest of the duration
+        self.memory.flush_expired(min(self.memory.dirty - self.get_dirty_bg_threshold(),
+                                      duration * write_bw - flushed_amt), math.inf, files=flushed)
 
-        return self.storage.write(flushed_amt)
+        return self.storage.write_files(flushed)
 
     def evict(self, amount):
         if amount > 0:
@@ -530,8 +1030,82 @@ class IOManager:
         self.memory.free += file.size
 
     def compute(self, start_time, cpu_time=0):
-        self.period_flush(start_time + cpu_time, cpu_time)
-        return start_time + cpu_time
+        return self.fast_forward(start_time, cpu_time)
+
+    def fast_forward(self, start_time, duration=0):
+        """
+        Advance through a compute or idle period without I/O.
+        Dirty data above dirty_bg_ratio is first flushed in the background at disk bw, oldest first.
+        Then periodical flushing happens at every pdflush_interval tick and flushes at most
+        pdflush_interval * disk write bw of expired dirty data per tick. The amount of expired data
+        only changes at the ticks where some block expires, so between two such ticks the flushed
+        amount grows linearly until the expired data is exhausted. The whole period is therefore
+        solved per expiry step instead of per tick, and a log point is added at the start and the
+        end of each flushing run.
+        :param start_time: start of the period
+        :param duration: length of the period
+        :return: end of the period
+        """
+        end_time = start_time + duration
+
+        # background flushing of the oldest dirty data down to dirty_bg_ratio, at disk bw from start_time
+        write_bw = self.storage.get_write_bw(self.memory.dirty)
+        bg_amt = min(self.memory.dirty - self.get_dirty_bg_threshold(), duration * write_bw)
+        if bg_amt > 0:
+            flushed = {}
+            self.memory.add_log(start_time)
+            self.memory.flush_expired(bg_amt, math.inf, files=flushed)
+            start_time = min(end_time, start_time + self.storage.write_files(flushed))
+            self.memory.add_log(start_time)
+            write_bw = self.storage.get_write_bw(self.memory.dirty)
+
+        ticks = int((end_time - self.last_pdflush) / self.pdflush_interval)
+        if ticks <= 0:
+            return end_time
+
+        origin = self.last_pdflush
+        # ticks up to start_time were covered by the periodical flushing of previous I/O calls
+        # or by background flushing
+        first_tick = max(1, int((start_time - origin) / self.pdflush_interval) + 1)
+        per_tick = self.pdflush_interval * write_bw
+        expire = self.memory.dirty_expire
+
+        # dirty data grouped by the first tick at which it is expired
+        expiring = {}
+        for block in self.memory.inactive + self.memory.active:
+            if block.dirty and block.size > 0:
+                tick = max(first_tick, int((block.last_access + expire - origin) / self.pdflush_interval) + 1)
+                if tick <= ticks:
+                    expiring[tick] = expiring.get(tick, 0) + block.size
+
+        steps = sorted(expiring.items())
+        backlog = 0
+        for i in range(len(steps)):
+            tick, amount = steps[i]
+            next_tick = steps[i + 1][0] if i + 1 < len(steps) else ticks + 1
+            backlog += amount
+            if per_tick <= 0 or backlog <= 0:
+                continue
+
+            # ticks needed to flush the backlog, limited to the ticks before the next expiry
+            flush_ticks = min(next_tick - tick, math.ceil(backlog / per_tick))
+            amount = min(backlog, flush_ticks * per_tick)
+            first = origin + tick * self.pdflush_interval
+            last = origin + (tick + flush_ticks - 1) * self.pdflush_interval
+
+            flushed = {}
+            self.memory.add_log(first)
+            backlog -= self.memory.flush_expired(amount, last - expire, files=flushed)
+            # background flushing, the time is not charged to the application
+            self.storage.write_files(flushed)
+            self.memory.add_log(last)
+
+        self.last_pdflush = origin + ticks * self.pdflush_interval
+
+        return end_time
 
     def get_dirty_threshold(self):
         return self.memory.get_available_memory() * self.dirty_ratio
+
+    def get_dirty_bg_threshold(self):
+        return self.memory.get_available_memory() * self.dirty_bg_ratio
@@ -1,6 +1,4 @@
 import log_parse
-import matplotlib.pyplot as plt
-import numpy as np
 
 
 def get_atop_mem_prop(time_log, mem_log, key):
@@ -48,6 +46,15 @@ def task_time_error(realtime_logfile, simtime_logfile):
     real_time = log_parse.read_timelog(realtime_logfile, skip_header=False)
     sim_time = log_parse.read_timelog(simtime_logfile)
 
+    return task_errors(real_time, sim_time)
+
+
+def task_errors(real_time, sim_time):
+    """
+    :param real_time: real time log tuple
+    :param sim_time: simulation time log tuple
+    :return: list of relative errors of task durations
+    """
     time_acc = []
 
     for i in range(len(sim_time)):
@@ -89,6 +96,9 @@ def mem_error(real_time_logfile, sim_time_logfile, real_mem_logfile, sim_mem_log
 
 
 def grouped_bar_chart(labels, title, xlabel, ylabel, *argv):
+    import matplotlib.pyplot as plt
+    import numpy as np
+
     x = np.arange(len(labels))  # the label locations
     width = 0.2  # the width of the bars
     bars = len(argv)
@@ -124,9 +134,10 @@ def plot_task_error(size):
                       ("Python", py_error), ("Original SimGrid", simgrid_error))
 
 
-sizes = [20, 50, 75, 100]
-for size in sizes:
-    plot_task_error(size)
+if __name__ == "__main__":
+    sizes = [20, 50, 75, 100]
+    for size in sizes:
+        plot_task_error(size)
 
 # dirty_acc, cache_acc = mem_error(real_time_log, sim_time_log, atop_file, sim_logfile)
 
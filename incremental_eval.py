@@ -0,0 +1,184 @@
+"""
+Incremental evaluation of simulated task times against real logs.
+
+Each experiment has a real time log and several sources of simulated task times. A source is
+either an existing time log (csv) or simulator parameters, in which case the pipeline is simulated.
+The fingerprint of a (experiment, source) pair depends on the content of its input logs and on the
+parser and error code, and for simulated sources on the parameters and the simulator code. Only
+pairs whose fingerprint changed are recomputed.
+
+Everything is kept in a single SQLite file: parsed time logs, fingerprints, and one task_errors table
+holding the per-task errors of all experiments, which can be queried directly.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+
+import log_parse
+from evaluate import task_errors
+from pipeline import EX1_COMPUTE_TIME
+
+PARSER_CODE = ["log_parse.py"]
+EVALUATION_CODE = ["evaluate.py", "log_parse.py"]
+SIMULATOR_CODE = ["components.py", "pipeline.py"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS time_logs (
+    fingerprint TEXT, task INTEGER, type TEXT, start REAL, end REAL,
+    PRIMARY KEY (fingerprint, task)
+);
+CREATE TABLE IF NOT EXISTS evaluated (
+    experiment TEXT, source TEXT, fingerprint TEXT,
+    PRIMARY KEY (experiment, source)
+);
+CREATE TABLE IF NOT EXISTS task_errors (
+    experiment TEXT, source TEXT, task INTEGER, type TEXT, real REAL, sim REAL, error REAL,
+    PRIMARY KEY (experiment, source, task)
+);
+CREATE INDEX IF NOT EXISTS task_errors_source ON task_errors (source, type);
+"""
+
+
+def ex1_experiments(sizes=tuple(EX1_COMPUTE_TIME)):
+    """
+    Experiments of real_log/ex1, compared with the python logs, SimGrid and the current simulator
+    :param sizes: input sizes in GB
+    :return: list of experiment dictionaries
+    """
+    return [{
+        "name": "ex1/%dgb" % size,
+        "real_log": "real_log/ex1/%dgb/timestamps_pipeline.csv" % size,
+        "sources": {
+            "python": "py_log/ex1/new/%dgb_sim_time.csv" % size,
+            "simgrid": "simgrid/ex1/timestamp_sim_exp1_%dgb.csv" % size,
+            "simulator": {"profile": "ex1", "input_size": size * 1000, "compute_time": EX1_COMPUTE_TIME[size]},
+        },
+    } for size in sizes]
+
+
+def file_fingerprint(filename):
+    with open(filename, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def code_fingerprint(filenames):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return hashlib.sha1("".join([file_fingerprint(os.path.join(directory, name))
+                                 for name in filenames]).encode("utf-8")).hexdigest()
+
+
+def params_fingerprint(params, code):
+    return hashlib.sha1((json.dumps(params, sort_keys=True) + code).encode("utf-8")).hexdigest()
+
+
+class EvaluationStore:
+    def __init__(self, path="eval_cache.sqlite", root=None):
+        """
+        :param path: SQLite file
+        :param root: directory the log paths are relative to, the directory of this module by default
+        """
+        self.root = root if root is not None else os.path.dirname(os.path.abspath(__file__))
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.parser_fingerprint = code_fingerprint(PARSER_CODE)
+        self.evaluation_fingerprint = code_fingerprint(EVALUATION_CODE)
+        self.code_fingerprint = code_fingerprint(SIMULATOR_CODE)
+
+    def close(self):
+        self.db.close()
+
+    def get_time_log(self, fingerprint):
+        rows = self.db.execute("SELECT type, start, end FROM time_logs WHERE fingerprint = ? ORDER BY task",
+                               (fingerprint,)).fetchall()
+        return [tuple(row) for row in rows] if rows else None
+
+    def put_time_log(self, fingerprint, time_log):
+        self.db.executemany("INSERT OR REPLACE INTO time_logs VALUES (?, ?, ?, ?, ?)",
+                            [(fingerprint, i, task[0], task[1], task[2]) for i, task in enumerate(time_log)])
+
+    def load_file(self, filename, skip_header):
+        """
+        Parse a time log, or return the copy parsed earlier if the file did not change
+        :return: (fingerprint, time log)
+        """
+        path = os.path.join(self.root, filename)
+        fingerprint = file_fingerprint(path) + ":" + self.parser_fingerprint
+        time_log = self.get_time_log(fingerprint)
+        if time_log is None:
+            time_log = log_parse.read_timelog(path, skip_header=skip_header)
+            self.put_time_log(fingerprint, time_log)
+        return fingerprint, time_log
+
+    def load_simulation(self, params):
+        """
+        Simulate a pipeline, or return the task times simulated earlier with the same parameters and code
+        :return: (fingerprint, time log)
+        """
+        fingerprint = params_fingerprint(params, self.code_fingerprint)
+        time_log = self.get_time_log(fingerprint)
+        if time_log is None:
+            from pipeline import create_kernel
+            from pipeline import run_pipeline
+
+            kernel = create_kernel(params.get("profile", "ex1"), **params.get("overrides", {}))
+            time_log = run_pipeline(kernel, params["input_size"], params["compute_time"],
+                                    n_tasks=params.get("n_tasks", 3), verbose=False)
+            self.put_time_log(fingerprint, time_log)
+        return fingerprint, time_log
+
+    def source_fingerprint(self, source):
+        if isinstance(source, dict):
+            return params_fingerprint(source, self.code_fingerprint)
+        return file_fingerprint(os.path.join(self.root, source))
+
+    def evaluate(self, experiments):
+        """
+        Compute the per-task errors of the experiments whose inputs changed
+        :param experiments: list of experiment dictionaries
+        :return: list of (experiment, source) pairs recomputed
+        """
+        recomputed = []
+        for experiment in experiments:
+            name = experiment["name"]
+            real_fingerprint = file_fingerprint(os.path.join(self.root, experiment["real_log"]))
+
+            for source_name, source in experiment["sources"].items():
+                fingerprint = ":".join([real_fingerprint, self.source_fingerprint(source), self.evaluation_fingerprint])
+                row = self.db.execute("SELECT fingerprint FROM evaluated WHERE experiment = ? AND source = ?",
+                                      (name, source_name)).fetchone()
+                if row is not None and row[0] == fingerprint:
+                    continue
+
+                _, real_log = self.load_file(experiment["real_log"], skip_header=False)
+                if isinstance(source, dict):
+                    _, sim_log = self.load_simulation(source)
+                else:
+                    _, sim_log = self.load_file(source, skip_header=True)
+
+                errors = task_errors(real_log, sim_log)
+                self.db.execute("DELETE FROM task_errors WHERE experiment = ? AND source = ?", (name, source_name))
+                self.db.executemany("INSERT INTO task_errors VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    [(name, source_name, i, sim_log[i][0], real_log[i][2] - real_log[i][1],
+                                      sim_log[i][2] - sim_log[i][1], errors[i]) for i in range(len(errors))])
+                self.db.execute("INSERT OR REPLACE INTO evaluated VALUES (?, ?, ?)", (name, source_name, fingerprint))
+                recomputed.append((name, source_name))
+
+        self.db.commit()
+        return recomputed
+
+    def get_errors(self, experiment=None, source=None):
+        """
+        :return: list of (experiment, source, task, type, real duration, simulated duration, error)
+        """
+        query = "SELECT * FROM task_errors WHERE (? IS NULL OR experiment = ?) AND (? IS NULL OR source = ?) " \
+                "ORDER BY experiment, source, task"
+        return self.db.execute(query, (experiment, experiment, source, source)).fetchall()
+
+    def get_mean_errors(self):
+        """
+        :return: list of (source, type, mean error, max error, number of tasks)
+        """
+        return self.db.execute("SELECT source, type, AVG(error), MAX(error), COUNT(*) FROM task_errors "
+                               "GROUP BY source, type ORDER BY source, type").fetchall()
@@ -51,6 +51,7 @@ def read_sim_log(filename):
     sys_mem = []
     cache_used = []
     dirty_data = []
+    used_mem = []
 
     with open(filename) as csv_file:
         csv_reader = csv.reader(csv_file, delimiter=',')
@@ -61,10 +62,12 @@ def read_sim_log(filename):
             sys_mem.append(float(line[1]))
             dirty_data.append(float(line[2]))
             cache_used.append(float(line[3]))
+            used_mem.append(float(line[4]))
 
     return {
         "time": time,
         "total": sys_mem,
         "dirty_data": dirty_data,
-        "cache": cache_used
+        "cache": cache_used,
+        "used_mem": used_mem
     }
@@ -0,0 +1,280 @@
+"""
+Parallel runner for many independent host simulations.
+
+Workers write the result of each run into a fixed-size record of a shared buffer instead of sending
+it back to the parent, so nothing but the run index is pickled. The buffer is backed by
+multiprocessing.shared_memory, or by a memory-mapped file when a path is given, in which case the
+results of a very large number of runs do not need to fit in memory.
+
+Record of a run (all float64):
+
+    makespan, length of the memory log,
+    start and end of every task (read and write of each pipeline stage, in order),
+    max_log memory log points of (time, total, dirty, cache, used)
+
+Only the first max_log points of longer memory logs are kept, the record has the full length so
+that truncated logs are counted by summarize. The results are aggregated by streaming over
+strided views of the buffer, in memory that does not depend on the number of runs.
+"""
+
+import functools
+import math
+import mmap
+import os
+from multiprocessing import Pool
+from multiprocessing import shared_memory
+
+from pipeline import create_kernel
+from pipeline import run_pipeline
+
+ITEM_SIZE = 8
+MEM_FIELDS = ["time", "total", "dirty", "cache", "used"]
+
+
+class ResultBuffer:
+    def __init__(self, n_runs, n_tasks=3, max_log=256, path=None, name=None, create=True):
+        """
+        :param n_runs: number of runs
+        :param n_tasks: number of pipeline stages of every run
+        :param max_log: maximum number of memory log points kept per run
+        :param path: memory-mapped file backing the buffer, shared memory is used if None
+        :param name: name of an existing shared memory block to attach to
+        :param create: create the buffer, otherwise attach to an existing one
+        """
+        self.n_runs = n_runs
+        self.n_tasks = n_tasks
+        self.max_log = max_log
+        self.path = path
+        self.record_len = 2 + 2 * n_tasks * 2 + max_log * len(MEM_FIELDS)
+        # an empty buffer cannot be mapped or cast, keep at least one value
+        size = max(ITEM_SIZE, n_runs * self.record_len * ITEM_SIZE)
+
+        self.shm = None
+        self.mmap = None
+        if path is not None:
+            with open(path, "r+b" if not create else "w+b") as f:
+                if create:
+                    f.truncate(size)
+                self.mmap = mmap.mmap(f.fileno(), size)
+            buffer = self.mmap
+        else:
+            self.shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+            buffer = self.shm.buf
+        self.view = memoryview(buffer)
+        self.values = self.view.cast("d")
+
+    @property
+    def name(self):
+        return self.shm.name if self.shm is not None else None
+
+    def attach_args(self):
+        """
+        :return: arguments to attach to this buffer from another process
+        """
+        return self.n_runs, self.n_tasks, self.max_log, self.path, self.name
+
+    @classmethod
+    def attach(cls, n_runs, n_tasks, max_log, path, name):
+        return cls(n_runs, n_tasks, max_log, path=path, name=name, create=False)
+
+    def write_run(self, index, tasks, mem_log):
+        """
+        Write the result of a run to its record
+        :param index: run index
+        :param tasks: list of (type, start, end) tuples
+        :param mem_log: memory log dictionary
+        """
+        offset = index * self.record_len
+        values = self.values
+        n_log = min(len(mem_log["time"]), self.max_log)
+
+        values[offset] = tasks[-1][2] - tasks[0][1] if tasks else 0
+        values[offset + 1] = len(mem_log["time"])
+        pos = offset + 2
+        for task in tasks[:2 * self.n_tasks]:
+            values[pos] = task[1]
+            values[pos + 1] = task[2]
+            pos += 2
+
+        pos = offset + 2 + 4 * self.n_tasks
+        for i in range(n_log):
+            for field in MEM_FIELDS:
+                values[pos] = mem_log[field][i]
+                pos += 1
+
+    def field(self, index):
+        """
+        :param index: index of a value in the record
+        :return: view of the value in every run, without copy
+        """
+        return self.values[index:self.n_runs * self.record_len:self.record_len]
+
+    def makespans(self):
+        """
+        :return: view of the makespan of every run, without copy
+        """
+        return self.field(0)
+
+    def log_lengths(self):
+        """
+        :return: view of the full memory log length of every run, without copy
+        """
+        return self.field(1)
+
+    def task_durations(self, task):
+        """
+        :param task: task index, reads are even and writes odd
+        :return: iterator over the duration of the task in every run
+        """
+        return (end - start for start, end in zip(self.field(2 + 2 * task), self.field(3 + 2 * task)))
+
+    def get_mem_log(self, index):
+        """
+        :param index: run index
+        :return: memory log dictionary of a run, truncated to max_log points
+        """
+        offset = index * self.record_len
+        n_log = min(int(self.values[offset + 1]), self.max_log)
+        start = offset + 2 + 4 * self.n_tasks
+        width = len(MEM_FIELDS)
+        return {field: list(self.values[start + j:start + n_log * width:width]) for j, field in enumerate(MEM_FIELDS)}
+
+    def close(self):
+        self.values.release()
+        self.view.release()
+        if self.shm is not None:
+            self.shm.close()
+        if self.mmap is not None:
+            self.mmap.close()
+
+    def unlink(self):
+        if self.shm is not None:
+            self.shm.unlink()
+        elif self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def bounded_percentiles(values, qs, bins=4096):
+    """
+    Percentiles with linear interpolation between closest ranks, in memory bounded by bins.
+    Up to bins values are sorted and the percentiles are exact. Above, a second pass counts the
+    values in bins equal-width bins between their min and max and the percentiles are interpolated
+    within their bin, so they are off by at most (max - min) / bins.
+    :param values: function returning a new iterator over the values
+    :param qs: percentiles in [0, 100]
+    :param bins: maximum number of values sorted, number of bins of the histogram
+    :return: dictionary "p<q>" -> percentile, and "max" -> max of the values
+    """
+    count = 0
+    low = math.inf
+    high = -math.inf
+    sample = []
+    for value in values():
+        count += 1
+        low = min(low, value)
+        high = max(high, value)
+        if count <= bins:
+            sample.append(value)
+
+    summary = {"p%d" % q: float("nan") for q in qs}
+    summary["max"] = high if count else float("nan")
+    if count == 0:
+        return summary
+
+    if count <= bins:
+        sample.sort()
+        for q in qs:
+            rank = (count - 1) * q / 100
+            i = int(rank)
+            j = min(i + 1, count - 1)
+            summary["p%d" % q] = sample[i] + (sample[j] - sample[i]) * (rank - i)
+        return summary
+
+    sample = None
+    width = (high - low) / bins
+    counts = [0] * bins
+    if width > 0:
+        for value in values():
+            counts[min(int((value - low) / width), bins - 1)] += 1
+    else:
+        counts[0] = count
+
+    for q in qs:
+        rank = (count - 1) * q / 100
+        before = 0
+        for i in range(bins):
+            if before + counts[i] > rank:
+                break
+            before += counts[i]
+        # values are assumed evenly spread in their bin
+        summary["p%d" % q] = min(low + width * (i + (rank - before + 0.5) / counts[i]), high)
+    return summary
+
+
+def summarize(buffer, percentiles=(50, 90, 99), bins=4096):
+    """
+    Aggregate the makespan and task durations of all runs
+    :param buffer: ResultBuffer
+    :param percentiles: percentiles to compute
+    :param bins: memory bound of the percentile computation, see bounded_percentiles
+    :return: dictionary metric -> {"p50": ..., "max": ...}, log_points also has the number of
+        truncated memory logs
+    """
+    metrics = {"makespan": lambda: iter(buffer.makespans()), "log_points": lambda: iter(buffer.log_lengths())}
+    for task in range(2 * buffer.n_tasks):
+        metrics["%s%d" % ("read" if task % 2 == 0 else "write", task // 2 + 1)] = \
+            functools.partial(buffer.task_durations, task)
+
+    summary = {metric: bounded_percentiles(values, percentiles, bins) for metric, values in metrics.items()}
+    summary["log_points"]["truncated"] = sum(1 for length in buffer.log_lengths() if length > buffer.max_log)
+    return summary
+
+
+_buffer = None
+
+
+def init_worker(attach_args):
+    global _buffer
+    _buffer = ResultBuffer.attach(*attach_args)
+
+
+def run_one(job):
+    index, workload = job
+    kernel = create_kernel(workload.get("profile", "ex1"), **workload.get("overrides", {}))
+    tasks = run_pipeline(kernel, workload["input_size"], workload["compute_time"],
+                         n_tasks=_buffer.n_tasks, verbose=False)
+    _buffer.write_run(index, tasks, kernel.memory.get_log())
+    return index
+
+
+def run_parallel(workloads, n_tasks=3, max_log=256, workers=None, path=None, chunksize=64):
+    """
+    Run independent pipeline simulations in a process pool
+    :param workloads: list of workload dictionaries (profile, overrides, input_size, compute_time, n_tasks)
+    :param n_tasks: number of pipeline stages of every run, workloads with another n_tasks are rejected
+    :param max_log: maximum number of memory log points kept per run
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param path: memory-mapped result file, shared memory is used if None
+    :param chunksize: number of runs sent to a worker at once
+    :raise ValueError: if a workload does not have n_tasks stages
+    :return: ResultBuffer, to be closed and unlinked by the caller
+    """
+    for index, workload in enumerate(workloads):
+        if workload.get("n_tasks", n_tasks) != n_tasks:
+            raise ValueError("workload %d has %r tasks, the records hold %d" % (index, workload["n_tasks"], n_tasks))
+
+    buffer = ResultBuffer(len(workloads), n_tasks=n_tasks, max_log=max_log, path=path)
+    if not workloads:
+        return buffer
+
+    try:
+        with Pool(workers, initializer=init_worker, initargs=(buffer.attach_args(),)) as pool:
+            for _ in pool.imap_unordered(run_one, enumerate(workloads), chunksize=chunksize):
+                pass
+    except BaseException:
+        # the caller never gets the buffer, do not leak the shared memory or the result file
+        buffer.close()
+        buffer.unlink()
+        raise
+
+    return buffer
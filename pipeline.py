@@ -0,0 +1,165 @@
+import csv
+import contextlib
+import io
+import math
+
+from components import IOManager
+from components import File
+from components import Storage
+from components import MemoryManager
+from components import TieredStorage
+
+# Host profiles calibrated on the real experiments
+PROFILES = {
+    "ex1": {
+        "memory": {"size": 268600, "read_bw": 7100, "write_bw": 3300},
+        "storage": {"size": 450000, "read_bw": 465, "write_bw": 465},
+        "io": {"dirty_ratio": 0.4},
+    },
+    # ex1 host with a 150 GB NVMe tier in front of its disk, the NVMe values are nominal, not measured
+    "ex1_nvme": {
+        "memory": {"size": 268600, "read_bw": 7100, "write_bw": 3300},
+        "tiers": [{"size": 150000, "read_bw": 3000, "write_bw": 2000}],
+        "storage": {"size": 450000, "read_bw": 465, "write_bw": 465},
+        "io": {"dirty_ratio": 0.4},
+    },
+    # cloudvm-like host, 15.6 GB of memory and a 120 MBps disk. Not fitted: it does not reproduce
+    # cloudvm/*.csv, which no version of this model reproduces
+    "cloudvm": {
+        "memory": {"size": 15600, "read_bw": 2680, "write_bw": 650},
+        "storage": {"size": 450000, "read_bw": 120, "write_bw": 168},
+        "io": {"dirty_ratio": 0.2},
+    },
+}
+
+# CPU time of each task in sec for the input sizes of ex1 in GB
+EX1_COMPUTE_TIME = {20: 28, 50: 75, 75: 110, 100: 155}
+
+# parameters that can be overridden, and the values they accept
+PARAMETERS = {
+    "memory": {"size": "positive", "free": "non-negative", "read_bw": "positive", "write_bw": "positive"},
+    "storage": {"size": "positive", "read_bw": "positive", "write_bw": "positive", "latency": "non-negative"},
+    "io": {"dirty_ratio": "ratio", "dirty_bg_ratio": "ratio", "pdflush_interval": "positive",
+           "readahead_init": "positive", "readahead_max": "positive"},
+}
+
+
+def check_number(name, value, kind="non-negative"):
+    """
+    :param name: parameter name used in the error message
+    :param value: value to check
+    :param kind: "positive", "non-negative" or "ratio" (between 0 and 1)
+    :raise ValueError: if the value is not a finite number of the given kind
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError("%s must be a number, got %r" % (name, value))
+    if value < 0 or (kind == "positive" and value == 0) or (kind == "ratio" and value > 1):
+        raise ValueError("%s must be %s, got %r" % (name, "between 0 and 1" if kind == "ratio" else kind, value))
+
+
+def validate_overrides(profile, overrides):
+    """
+    :param profile: name of the profile in PROFILES
+    :param overrides: parameters overriding the profile, see create_kernel
+    :raise ValueError: if the profile is unknown or an override is not in PARAMETERS or out of range
+    """
+    if not isinstance(profile, str) or profile not in PROFILES:
+        raise ValueError("unknown profile: %r" % (profile,))
+    if not isinstance(overrides, dict):
+        raise ValueError("overrides must be a dictionary")
+    for section, params in overrides.items():
+        if section not in PARAMETERS or not isinstance(params, dict):
+            raise ValueError("overrides of %r: the sections are %s, each a dictionary of parameters"
+                             % (section, ", ".join(PARAMETERS)))
+        for param, value in params.items():
+            if param not in PARAMETERS[section]:
+                raise ValueError("unknown parameter: %s.%s" % (section, param))
+            check_number("%s.%s" % (section, param), value, PARAMETERS[section][param])
+
+
+def create_kernel(profile="ex1", **overrides):
+    """
+    Create an IOManager for a host profile. Profiles with tiers get a TieredStorage made of the
+    tiers, fastest first, in front of the storage.
+    :param profile: name of the profile in PROFILES
+    :param overrides: parameters overriding the profile, e.g. memory={"size": 1000}
+    :raise ValueError: if the profile or the overrides are invalid
+    :return: IOManager
+    """
+    validate_overrides(profile, overrides)
+    params = {key: [dict(tier) for tier in value] if key == "tiers" else dict(value)
+              for key, value in PROFILES[profile].items()}
+    for key, value in overrides.items():
+        params[key].update(value)
+
+    memory = params["memory"]
+    mm = MemoryManager(memory["size"], memory.get("free", memory["size"]),
+                       read_bw=memory["read_bw"], write_bw=memory["write_bw"])
+    storage = Storage(**params["storage"])
+    if params.get("tiers"):
+        storage = TieredStorage([Storage(**tier) for tier in params["tiers"]] + [storage])
+    return IOManager(mm, storage, **params["io"])
+
+
+def run_pipeline(kernel, input_size, compute_time, n_tasks=3, start_time=0, verbose=True):
+    """
+    Simulate a pipeline of tasks, each task reads the output of the previous one,
+    computes and writes its output
+    :param kernel: IOManager
+    :param input_size: size of every file in MB
+    :param compute_time: CPU time of every task in seconds
+    :param n_tasks: number of tasks
+    :param start_time: start time of the first task
+    :param verbose: print the simulation steps
+    :return: list of (type, start, end) tuples
+    """
+    files = [File("file%d" % (i + 1), input_size, input_size) for i in range(n_tasks + 1)]
+
+    tasks = []
+    run_time = start_time
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+
+        for i in range(n_tasks):
+            read_start = run_time
+            read_end = kernel.read(files[i], read_start)
+            compute_end = kernel.compute(read_end, compute_time)
+            run_time = kernel.write(files[i + 1], compute_end)
+            kernel.release(files[i + 1])
+            tasks.append(("read", read_start, read_end))
+            tasks.append(("write", compute_end, run_time))
+
+    return tasks
+
+
+def get_task_time(tasks):
+    """
+    :param tasks: list of (type, start, end) tuples
+    :return: dictionary of read/write start and end times, as used by plot.plot_mem_log
+    """
+    reads = [task for task in tasks if task[0] == "read"]
+    writes = [task for task in tasks if task[0] == "write"]
+    return {
+        "read_start": [task[1] for task in reads],
+        "read_end": [task[2] for task in reads],
+        "write_start": [task[1] for task in writes],
+        "write_end": [task[2] for task in writes],
+    }
+
+
+def export_mem(mem_log, filename):
+    with open(filename, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["time", "total_mem", "dirty", "cache", "used_mem"])
+        for i in range(len(mem_log["time"])):
+            writer.writerow([mem_log["time"][i], mem_log["total"][i], mem_log["dirty"][i],
+                             mem_log["cache"][i], mem_log["used"][i]])
+
+
+def export_time(task_list, filename):
+    with open(filename, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["type", "start", "end"])
+        for i in range(len(task_list)):
+            writer.writerow([task_list[i][0], task_list[i][1], task_list[i][2]])
@@ -0,0 +1,272 @@
+"""
+Golden output regression and performance budget harness.
+
+Every scenario is simulated and its task times and memory log are compared with reference csv files
+within a relative tolerance. The best wall time of several runs and the peak Python memory of the
+simulation are compared with the budget of the scenario, about 3 times the best wall time and twice the
+peak memory measured when the budget was set. Use --budget-scale on a slower machine.
+
+The reference files are looked up in golden/, a snapshot of the current model with the same layout as
+the logs shipped in the repository. A change that is meant to change the results must refresh it with
+--update golden/. With --golden-dir . the scenarios are compared with the shipped py_log/ex1/new and
+cloudvm logs instead; of these, only the 100 GB logs are reproduced, and only by the original model
+(baseline commit).
+Scenarios with a trace replay it instead of simulating a pipeline.
+
+    python regression.py                      # check all scenarios
+    python regression.py --rel-tol 0.01       # looser comparison
+    python regression.py --update golden/     # write the current outputs as the new reference set
+"""
+
+import argparse
+import contextlib
+import math
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import log_parse
+from pipeline import EX1_COMPUTE_TIME
+from pipeline import create_kernel
+from pipeline import export_mem
+from pipeline import export_time
+from pipeline import run_pipeline
+from trace_replay import TraceRecord
+from trace_replay import TraceReplayer
+
+MEM_KEYS = [("total", "total"), ("dirty_data", "dirty"), ("cache", "cache"), ("used_mem", "used")]
+
+# wall time in sec and peak memory in MB of every scenario
+BUDGETS = {
+    "ex1/20gb": {"wall_time": 0.0009, "peak_memory": 0.016},
+    "ex1/50gb": {"wall_time": 0.0012, "peak_memory": 0.017},
+    "ex1/75gb": {"wall_time": 0.0015, "peak_memory": 0.016},
+    "ex1/100gb": {"wall_time": 0.0016, "peak_memory": 0.018},
+    "ex1_nvme/100gb": {"wall_time": 0.0023, "peak_memory": 0.021},
+    "cloudvm/6000mb": {"wall_time": 0.0013, "peak_memory": 0.017},
+    "trace/readahead": {"wall_time": 0.0028, "peak_memory": 0.57},
+}
+
+# three reads continuing one read-ahead stream, then a read after a seek, which starts a new one
+READAHEAD_TRACE = [
+    TraceRecord(0, "open", "input", 1000),
+    TraceRecord(0, "read", "input", 100),
+    TraceRecord(0, "read", "input", 100),
+    TraceRecord(0, "read", "input", 100),
+    TraceRecord(0, "seek", "input", 600),
+    TraceRecord(0, "read", "input", 100),
+    TraceRecord(0, "close", "input", 0),
+]
+
+
+def default_scenarios():
+    """
+    :return: list of scenario dictionaries with their reference files and budgets
+    """
+    return [{
+        "name": "ex1/%dgb" % size,
+        "profile": "ex1",
+        "input_size": size * 1000,
+        "compute_time": compute_time,
+        "time_log": "py_log/ex1/new/%dgb_sim_time.csv" % size,
+        "mem_log": "py_log/ex1/new/%dgb_sim_mem.csv" % size,
+    } for size, compute_time in EX1_COMPUTE_TIME.items()] + [{
+        # the NVMe tier holds the promoted input and demotes written data back to the disk
+        "name": "ex1_nvme/100gb",
+        "profile": "ex1_nvme",
+        "input_size": 100000,
+        "compute_time": EX1_COMPUTE_TIME[100],
+        "time_log": "py_log/ex1_nvme/100gb_sim_time.csv",
+        "mem_log": "py_log/ex1_nvme/100gb_sim_mem.csv",
+    }, {
+        "name": "cloudvm/6000mb",
+        "profile": "cloudvm",
+        "input_size": 6000,
+        "compute_time": 13,
+        "time_log": "cloudvm/6000_sim_timestamps.csv",
+        "mem_log": "cloudvm/6000_simulator.csv",
+    }, {
+        "name": "trace/readahead",
+        "profile": "ex1",
+        "overrides": {"storage": {"latency": 0.002}},
+        "trace": READAHEAD_TRACE,
+        "time_log": "py_log/trace/readahead_sim_time.csv",
+        "mem_log": "py_log/trace/readahead_sim_mem.csv",
+    }]
+
+
+def simulate(scenario):
+    kernel = create_kernel(scenario["profile"], **scenario.get("overrides", {}))
+    if "trace" in scenario:
+        return replay(kernel, scenario["trace"])
+
+    tasks = run_pipeline(kernel, scenario["input_size"], scenario["compute_time"],
+                         n_tasks=scenario.get("n_tasks", 3), verbose=False)
+    return tasks, kernel.memory.get_log()
+
+
+def replay(kernel, records):
+    """
+    Replay a trace and read its outputs back
+    :return: (tasks, memory log)
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        mem_file = os.path.join(directory, "mem.csv")
+        time_file = os.path.join(directory, "time.csv")
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            TraceReplayer(kernel, mem_file, time_file).replay(records)
+
+        mem_log = log_parse.read_sim_log(mem_file)
+        mem_log = dict({key: mem_log[ref_key] for ref_key, key in MEM_KEYS}, time=mem_log["time"])
+        return log_parse.read_timelog(time_file), mem_log
+
+
+def measure(scenario, repeat=20):
+    """
+    Simulate a scenario, repeat times for the best wall time and once under tracemalloc for the peak memory
+    :return: (tasks, memory log, wall time in sec, peak memory in MB)
+    """
+    wall_time = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        simulate(scenario)
+        wall_time = min(wall_time, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        tasks, mem_log = simulate(scenario)
+        peak_memory = tracemalloc.get_traced_memory()[1] / 1000 ** 2
+    finally:
+        tracemalloc.stop()
+
+    return tasks, mem_log, wall_time, peak_memory
+
+
+def close(a, b, rel_tol, abs_tol):
+    return math.isclose(a, b, rel_tol=rel_tol, abs_tol=abs_tol)
+
+
+def compare_tasks(reference, tasks, rel_tol, abs_tol):
+    """
+    :return: list of mismatch descriptions
+    """
+    if len(reference) != len(tasks):
+        return ["%d tasks, expected %d" % (len(tasks), len(reference))]
+
+    errors = []
+    for i in range(len(reference)):
+        ref, sim = reference[i], tasks[i]
+        if ref[0] != sim[0] or not close(ref[1], sim[1], rel_tol, abs_tol) or \
+                not close(ref[2], sim[2], rel_tol, abs_tol):
+            errors.append("task %d: %s %.4f-%.4f, expected %s %.4f-%.4f" % (i, sim[0], sim[1], sim[2], *ref))
+
+    return errors
+
+
+def mem_values_at(mem_log, t, abs_tol):
+    """
+    Memory values of a simulated log at a time. Several rows can share a time (steps), otherwise the
+    value is interpolated between the surrounding rows.
+    :return: list of value tuples
+    """
+    times = mem_log["time"]
+    rows = [i for i in range(len(times)) if abs(times[i] - t) <= abs_tol]
+    if rows:
+        return [tuple(mem_log[key][i] for _, key in MEM_KEYS) for i in rows]
+
+    after = next((i for i in range(len(times)) if times[i] > t), None)
+    if after is None or after == 0:
+        return []
+    ratio = (t - times[after - 1]) / (times[after] - times[after - 1])
+    return [tuple(mem_log[key][after - 1] + (mem_log[key][after] - mem_log[key][after - 1]) * ratio
+                  for _, key in MEM_KEYS)]
+
+
+def compare_mem(reference, mem_log, rel_tol, abs_tol):
+    """
+    Every row of the reference log must match one of the simulated values at the same time
+    :return: list of mismatch descriptions
+    """
+    errors = []
+    for i in range(len(reference["time"])):
+        t = reference["time"][i]
+        expected = tuple(reference[key][i] for key, _ in MEM_KEYS)
+        candidates = mem_values_at(mem_log, t, abs_tol)
+        if not any(all(close(a, b, rel_tol, abs_tol) for a, b in zip(values, expected)) for values in candidates):
+            found = ", ".join(["(%s)" % ", ".join(["%.1f" % v for v in values]) for values in candidates])
+            errors.append("mem at %.4f: %s, expected (%s)" % (t, found or "no data",
+                                                              ", ".join(["%.1f" % v for v in expected])))
+
+    return errors
+
+
+def check(scenario, rel_tol=1e-6, abs_tol=1e-6, budget_scale=1.0, repeat=20):
+    """
+    Run a scenario and compare it with its reference files and budget
+    :return: (wall time, peak memory, list of failure descriptions)
+    """
+    tasks, mem_log, wall_time, peak_memory = measure(scenario, repeat)
+
+    failures = compare_tasks(log_parse.read_timelog(scenario["time_log"]), tasks, rel_tol, abs_tol)
+    failures += compare_mem(log_parse.read_sim_log(scenario["mem_log"]), mem_log, rel_tol, abs_tol)
+
+    budget = BUDGETS[scenario["name"]]
+    if wall_time > budget["wall_time"] * budget_scale:
+        failures.append("wall time %.2f ms over budget %.2f ms" % (wall_time * 1000,
+                                                                  budget["wall_time"] * budget_scale * 1000))
+    if peak_memory > budget["peak_memory"] * budget_scale:
+        failures.append("peak memory %.3f MB over budget %.3f MB" % (peak_memory, budget["peak_memory"] * budget_scale))
+
+    return wall_time, peak_memory, failures
+
+
+def update(scenarios, directory):
+    """
+    Write the current outputs of the scenarios as reference files in a directory
+    """
+    for scenario in scenarios:
+        tasks, mem_log = simulate(scenario)
+        for key, data, export in (("time_log", tasks, export_time), ("mem_log", mem_log, export_mem)):
+            path = os.path.join(directory, scenario[key])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            export(data, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Golden output regression and performance budget check")
+    parser.add_argument("--rel-tol", type=float, default=1e-6, help="relative tolerance of the comparison")
+    parser.add_argument("--abs-tol", type=float, default=1e-6, help="absolute tolerance of the comparison")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="multiply all performance budgets")
+    parser.add_argument("--repeat", type=int, default=20, help="number of runs the best wall time is taken from")
+    parser.add_argument("--golden-dir", default="golden", help="directory the reference files are relative to")
+    parser.add_argument("--only", action="append", help="run only the named scenarios")
+    parser.add_argument("--update", metavar="DIR", help="write the current outputs as references in DIR")
+    args = parser.parse_args(argv)
+
+    scenarios = [scenario for scenario in default_scenarios() if not args.only or scenario["name"] in args.only]
+    if args.update:
+        update(scenarios, args.update)
+        print("Wrote %d scenarios to %s" % (len(scenarios), args.update))
+        return 0
+
+    failed = 0
+    for scenario in scenarios:
+        for key in ("time_log", "mem_log"):
+            scenario[key] = os.path.join(args.golden_dir, scenario[key])
+
+        wall_time, peak_memory, failures = check(scenario, args.rel_tol, args.abs_tol, args.budget_scale,
+                                                 args.repeat)
+        print("%-16s %-4s wall=%.2fms peak=%.3fMB" % (scenario["name"], "FAIL" if failures else "ok",
+                                                      wall_time * 1000, peak_memory))
+        for failure in failures:
+            print("\t" + failure)
+        failed += bool(failures)
+
+    print("%d/%d scenarios passed" % (len(scenarios) - failed, len(scenarios)))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""
+Local simulation server.
+
+The server keeps the worker processes (with their imports), the host profiles and the parsed real
+logs in memory, so a request only pays for the simulation itself. Workloads are JSON objects:
+
+    {"profile": "ex1", "overrides": {"memory": {"size": 100000}},
+     "input_size": 20000, "compute_time": 28, "n_tasks": 3,
+     "real_log": "real_log/ex1/20gb/timestamps_pipeline.csv", "mem_log": false}
+
+POST /simulate runs a workload and returns the task times, the memory log if mem_log is set and
+the per-task error if real_log is given. GET /profiles returns the known host profiles. Invalid
+workloads are answered with 400 and failed simulations with 500, both with an {"error": ...} body.
+"""
+
+import csv
+import json
+import threading
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import log_parse
+from evaluate import task_errors
+from pipeline import PROFILES
+from pipeline import check_number
+from pipeline import create_kernel
+from pipeline import run_pipeline
+from pipeline import validate_overrides
+
+
+def validate(workload):
+    """
+    Check a workload before it is simulated
+    :param workload: decoded JSON body
+    :raise ValueError: if the workload is invalid
+    """
+    if not isinstance(workload, dict):
+        raise ValueError("workload must be a JSON object")
+
+    profile = workload.get("profile", "ex1")
+    overrides = workload.get("overrides", {})
+    validate_overrides(profile, overrides)
+    # building a kernel also checks the combination of parameters, e.g. of the dirty ratios
+    create_kernel(profile, **overrides)
+
+    for key in ("input_size", "compute_time"):
+        if key not in workload:
+            raise ValueError("missing %s" % key)
+    check_number("input_size", workload["input_size"], "positive")
+    check_number("compute_time", workload["compute_time"])
+    check_number("start_time", workload.get("start_time", 0))
+
+    n_tasks = workload.get("n_tasks", 3)
+    if isinstance(n_tasks, bool) or not isinstance(n_tasks, int) or n_tasks < 1:
+        raise ValueError("n_tasks must be a positive integer, got %r" % (n_tasks,))
+
+    real_log = workload.get("real_log")
+    if real_log is not None and not isinstance(real_log, str):
+        raise ValueError("real_log must be a file name")
+
+
+def simulate(workload):
+    """
+    Run a workload, this is executed in the worker processes
+    :param workload: workload dictionary
+    :return: result dictionary
+    """
+    kernel = create_kernel(workload.get("profile", "ex1"), **workload.get("overrides", {}))
+    tasks = run_pipeline(kernel, workload["input_size"], workload["compute_time"],
+                         n_tasks=workload.get("n_tasks", 3), start_time=workload.get("start_time", 0),
+                         verbose=False)
+
+    result = {"tasks": tasks}
+    if workload.get("mem_log", False):
+        result["mem_log"] = kernel.memory.get_log()
+
+    return result
+
+
+class SimulationServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 8642), workers=None):
+        """
+        :param address: (host, port) to listen on
+        :param workers: number of worker processes, defaults to the number of CPUs
+        """
+        super().__init__(address, SimulationHandler)
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.real_logs = {}
+        self.real_logs_lock = threading.Lock()
+
+    def get_real_log(self, filename):
+        """
+        Parse a real time log once and keep it in memory
+        :param filename: real time log file
+        :return: real time log tuple
+        """
+        with self.real_logs_lock:
+            if filename not in self.real_logs:
+                try:
+                    self.real_logs[filename] = log_parse.read_timelog(filename, skip_header=False)
+                except (IndexError, ValueError, csv.Error) as e:
+                    raise ValueError("%s is not a time log: %s" % (filename, e))
+            return self.real_logs[filename]
+
+    def check(self, workload):
+        """
+        Validate a workload and load its real time log
+        :param workload: decoded JSON body
+        :raise ValueError: if the workload is invalid
+        :return: real time log tuple, None if the workload has none
+        """
+        validate(workload)
+        if not workload.get("real_log"):
+            return None
+
+        real_log = self.get_real_log(workload["real_log"])
+        n_tasks = 2 * workload.get("n_tasks", 3)
+        if len(real_log) < n_tasks:
+            raise ValueError("%s has %d tasks, the workload has %d" % (workload["real_log"], len(real_log), n_tasks))
+        if any(task[2] <= task[1] for task in real_log[:n_tasks]):
+            raise ValueError("%s has a task of zero duration" % workload["real_log"])
+        return real_log
+
+    def run(self, workload, real_log=None):
+        """
+        :param workload: workload dictionary checked by check
+        :param real_log: real time log to compute the per-task error against
+        :return: result dictionary
+        """
+        result = self.pool.submit(simulate, workload).result()
+        if real_log is not None:
+            result["error"] = task_errors(real_log, result["tasks"])
+        return result
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown()
+
+
+class SimulationHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == "/profiles":
+            self.send_json(200, PROFILES)
+        else:
+            self.send_json(404, {"error": "not found: %s" % self.path})
+
+    def do_POST(self):
+        if self.path != "/simulate":
+            self.send_json(404, {"error": "not found: %s" % self.path})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            workload = json.loads(self.rfile.read(length))
+            real_log = self.server.check(workload)
+        except (ValueError, OSError) as e:
+            self.send_json(400, {"error": "%s: %s" % (type(e).__name__, e)})
+            return
+
+        try:
+            result = self.server.run(workload, real_log)
+        except Exception as e:
+            self.send_json(500, {"error": "%s: %s" % (type(e).__name__, e)})
+            return
+        self.send_json(200, result)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def submit(workload, url="http://127.0.0.1:8642"):
+    """
+    Submit a workload to a running server
+    :param workload: workload dictionary
+    :param url: server url
+    :return: result dictionary
+    """
+    request = urllib.request.Request(url + "/simulate", data=json.dumps(workload).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def serve(host="127.0.0.1", port=8642, workers=None):
+    server = SimulationServer((host, port), workers=workers)
+    print("Serving simulations on http://%s:%d" % (host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,216 @@
+"""
+Streaming replay of recorded I/O traces.
+
+A trace is a sequence of timestamped records:
+
+    time, op, file, amount
+
+where op is one of open, read, write, close, compute or seek. For open it is the file size in MB,
+for read and write the data size in MB (0 means the size given when the file was opened), for
+compute the CPU time in seconds, for seek the new offset in the file in MB, and for close it is
+ignored. Reads and writes of an open file start where the previous one ended, or at the offset of
+a seek in between. Reads stop at the end of the file and writes past it extend the file.
+
+Traces are stored either as CSV (with a header line) or in a binary format made of fixed-size
+records (see TRACE_RECORD). Both readers are generators that read the file chunk by chunk, and
+the replayer writes memory log and task time rows to disk as it goes, so memory use does not
+depend on the length of the trace.
+"""
+
+import csv
+import struct
+from collections import namedtuple
+
+from components import File
+
+TraceRecord = namedtuple("TraceRecord", ["time", "op", "file", "amount"])
+
+OPS = ["open", "read", "write", "close", "compute", "seek"]
+
+# timestamp (s), op code (index in OPS), filename (utf-8, NUL padded), amount (MB or s)
+TRACE_RECORD = struct.Struct("<dB64sd")
+
+MEM_LOG_HEADER = ["time", "total_mem", "dirty", "cache", "used_mem"]
+TIME_LOG_HEADER = ["type", "start", "end"]
+
+
+def read_csv_trace(filename, chunk_size=1 << 20):
+    """
+    Lazily read a CSV trace
+    :param filename: trace file
+    :param chunk_size: size of the read buffer in bytes
+    :return: generator of TraceRecord
+    """
+    with open(filename, newline='', buffering=chunk_size) as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=',')
+        next(csv_reader)
+
+        for line in csv_reader:
+            if not line:
+                continue
+            amount = float(line[3]) if len(line) > 3 and line[3].strip() else 0
+            yield TraceRecord(float(line[0]), line[1].strip(), line[2].strip(), amount)
+
+
+def read_binary_trace(filename, records_per_chunk=65536):
+    """
+    Lazily read a binary trace, records_per_chunk records at a time
+    :param filename: trace file
+    :param records_per_chunk: number of records read from the file at once
+    :return: generator of TraceRecord
+    """
+    chunk_bytes = TRACE_RECORD.size * records_per_chunk
+    with open(filename, "rb") as bin_file:
+        while True:
+            chunk = bin_file.read(chunk_bytes)
+            if not chunk:
+                break
+            if len(chunk) % TRACE_RECORD.size != 0:
+                raise ValueError("Truncated trace record in %s" % filename)
+
+            for time, op, name, amount in TRACE_RECORD.iter_unpack(chunk):
+                yield TraceRecord(time, OPS[op], name.rstrip(b"\0").decode("utf-8"), amount)
+
+
+def read_trace(filename):
+    """
+    Read a trace, the format is chosen from the file extension (.csv or binary otherwise)
+    :param filename: trace file
+    :return: generator of TraceRecord
+    """
+    if filename.endswith(".csv"):
+        return read_csv_trace(filename)
+    return read_binary_trace(filename)
+
+
+def write_binary_trace(records, filename):
+    """
+    Convert a stream of records (e.g. from read_csv_trace) to the binary trace format
+    :param records: iterable of TraceRecord
+    :param filename: output file
+    :return: number of records written
+    """
+    count = 0
+    with open(filename, "wb") as bin_file:
+        for record in records:
+            name = record.file.encode("utf-8")
+            if len(name) > 64:
+                raise ValueError("Filename longer than 64 bytes: %s" % record.file)
+            bin_file.write(TRACE_RECORD.pack(record.time, OPS.index(record.op), name, record.amount))
+            count += 1
+
+    return count
+
+
+class TraceReplayer:
+    """
+    Replay a trace through an IOManager.
+
+    Operations are replayed one after the other in simulated time. If honor_timestamps is set,
+    an operation does not start before its offset from the first record of the trace, and the
+    gap is simulated as idle time (periodical flushing still happens).
+    """
+
+    def __init__(self, io_manager, mem_log_file, time_log_file, honor_timestamps=False):
+        """
+        :param io_manager: IOManager to drive
+        :param mem_log_file: output csv for the memory log
+        :param time_log_file: output csv for task times
+        :param honor_timestamps: do not start an operation before its recorded time
+        """
+        self.kernel = io_manager
+        self.mem_log_file = mem_log_file
+        self.time_log_file = time_log_file
+        self.honor_timestamps = honor_timestamps
+        self.files = {}
+        # filename -> offset in MB where the next read or write of the open file starts
+        self.offsets = {}
+        # filename -> memory taken by the application for the data read, released on close
+        self.taken = {}
+
+    def replay(self, records, start_time=0):
+        """
+        Replay all records
+        :param records: iterable of TraceRecord
+        :param start_time: simulated start time
+        :return: simulated end time
+        """
+        run_time = start_time
+        trace_start = None
+
+        with open(self.mem_log_file, 'w', newline='') as mem_csv, \
+                open(self.time_log_file, 'w', newline='') as time_csv:
+            mem_writer = csv.writer(mem_csv)
+            time_writer = csv.writer(time_csv)
+            mem_writer.writerow(MEM_LOG_HEADER)
+            time_writer.writerow(TIME_LOG_HEADER)
+
+            for record in records:
+                if trace_start is None:
+                    trace_start = record.time
+
+                if self.honor_timestamps:
+                    offset = start_time + record.time - trace_start
+                    if offset > run_time:
+                        run_time = self.kernel.compute(run_time, offset - run_time)
+
+                run_time = self.apply(record, run_time, time_writer)
+                self.drain_log(mem_writer)
+
+        return run_time
+
+    def apply(self, record, run_time, time_writer):
+        """
+        Map a single record to IOManager calls
+        :param record: TraceRecord
+        :param run_time: current simulated time
+        :param time_writer: csv writer for task times
+        :return: simulated time after the operation
+        """
+        if record.op == "open":
+            self.files[record.file] = File(record.file, record.amount)
+            self.offsets[record.file] = 0
+        elif record.op == "close":
+            self.files.pop(record.file, None)
+            self.offsets.pop(record.file, None)
+            taken = self.taken.pop(record.file, 0)
+            if taken > 0:
+                self.kernel.release(File(record.file, taken))
+        elif record.op == "compute":
+            run_time = self.kernel.compute(run_time, record.amount)
+        elif record.op == "seek":
+            self.offsets[record.file] = record.amount
+        elif record.op in ("read", "write"):
+            file = self.files.get(record.file)
+            if file is None:
+                file = File(record.file, record.amount)
+                self.files[record.file] = file
+            offset = self.offsets.get(record.file, 0)
+            amount = record.amount if record.amount > 0 else file.size
+
+            start = run_time
+            if record.op == "read":
+                amount = max(0, min(amount, file.size - offset))
+                run_time = self.kernel.read(file, run_time, offset=offset, amount=amount)
+                self.taken[record.file] = self.taken.get(record.file, 0) + amount
+            else:
+                file.size = max(file.size, offset + amount)
+                run_time = self.kernel.write(file, run_time, offset=offset, amount=amount)
+            self.offsets[record.file] = offset + amount
+            time_writer.writerow([record.op, start, run_time])
+        else:
+            raise ValueError("Unknown trace operation: %s" % record.op)
+
+        return run_time
+
+    def drain_log(self, mem_writer):
+        """
+        Write the memory log accumulated so far and clear it from memory
+        :param mem_writer: csv writer for the memory log
+        """
+        log = self.kernel.memory.get_log()
+        for i in range(len(log["time"])):
+            mem_writer.writerow([log["time"][i], log["total"][i], log["dirty"][i],
+                                 log["cache"][i], log["used"][i]])
+        for key in log:
+            del log[key][:]